@@ -25,10 +25,21 @@ export default function Home() {
   useEffect(() => {
     const fetchPOIs = async () => {
       try {
-        const response = await fetch('/api/pois');
-        const data = await response.json();
+        // The API caps each page (MAX_POIS_PER_PAGE), so walk offset/total
+        // until the whole dataset is loaded
+        const allPois: any[] = [];
+        let offset = 0;
+        let total = Infinity;
+        while (offset < total) {
+          const response = await fetch(`/api/pois?offset=${offset}`);
+          const data = await response.json();
+          if (!data.pois?.length) break;
+          allPois.push(...data.pois);
+          total = data.total;
+          offset += data.limit;
+        }
         // Coerce to numbers and hard-filter to Israel bounding box
-        const cleaned: POI[] = data.pois
+        const cleaned: POI[] = allPois
           .map((p: any) => ({
             ...p,
             longitude: Number(p.longitude),
@@ -1,13 +1,22 @@
-from fastapi import FastAPI
+import re
+
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-import csv
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
 from pathlib import Path
-import csv
-import re
 from typing import Optional
-from statistics import mean
 
-app = FastAPI(title="Neighborhood Insights API", version="1.0.0")
+import numpy as np
+import orjson
+import pandas as pd
+from sklearn.neighbors import BallTree
+
+app = FastAPI(
+    title="Neighborhood Insights API",
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+)
 
 # Enable CORS for frontend
 app.add_middleware(
@@ -19,6 +28,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress large JSON payloads (POI lists compress ~10x thanks to repeated
+# field names); small responses are left alone.
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
 # Paths (resolve relative to this file so CWD doesn't matter)
 BASE_DIR = Path(__file__).resolve().parent
 RAW_PATH = (BASE_DIR.parent / "data" / "raw").resolve()
@@ -40,76 +53,86 @@ def normalize_coordinates_to_israel(original_lat: float, original_lon: float, po
     """
     return original_lat, original_lon
 
-def _safe_float(value: str) -> float | None:
-    try:
-        v = float(value)
-        if v != v:  # NaN
-            return None
-        return v
-    except Exception:
-        return None
-
 def load_mosdot_data():
     """Load POIs from the processed mosdot.csv only.
 
     Expected columns include at least: 'lon', 'lat', and Hebrew name fields.
-    We coerce lon/lat to floats and skip rows without valid coordinates.
+    The whole file is parsed in one vectorized pandas pass: numeric coercion,
+    the Israel bounding-box filter, the code/name split and the type mapping
+    are all column operations instead of per-row Python.
+
+    The parsed result is cached as mosdot.parquet next to the CSV; when the
+    parquet is newer than the CSV each worker loads the binary columnar file
+    (memory-mapped, shared via the page cache) instead of re-parsing.
     """
     mosdot_file = PROCESSED_PATH / "mosdot.csv"
+    parquet_file = PROCESSED_PATH / "mosdot.parquet"
     pois: list[dict] = []
     if not mosdot_file.exists():
         print(f"mosdot.csv not found at {mosdot_file}")
         return pois
 
+    if parquet_file.exists() and parquet_file.stat().st_mtime >= mosdot_file.stat().st_mtime:
+        try:
+            return pd.read_parquet(parquet_file).to_dict("records")
+        except Exception as e:
+            print(f"Error loading mosdot.parquet, falling back to CSV: {e}")
+
     try:
         # utf-8-sig to strip potential BOM
-        with open(mosdot_file, "r", encoding="utf-8-sig", newline="") as f:
-            reader = csv.DictReader(f)
-            for idx, row in enumerate(reader, start=1):
-                lon = _safe_float(row.get("lon", ""))
-                lat = _safe_float(row.get("lat", ""))
-                if lon is None or lat is None:
-                    continue
-
-                # Filter to Israel-ish bounding box to avoid geocode outliers
-                if not (29.0 <= lat <= 33.8 and 33.5 <= lon <= 36.5):
-                    continue
-
-                name_field = row.get("שם וסמל מוסד") or row.get("שם מוסד") or ""
-                # Try to split code from name if formatted like "1234 Name"
-                code_match = None
-                if isinstance(name_field, str):
-                    code_match = __import__('re').match(r"^(\d{2,6})\s+(.+)$", name_field.strip()) if name_field else None
-                if code_match:
-                    symbol_code = code_match.group(1)
-                    name_he = code_match.group(2)
-                else:
-                    symbol_code = ""
-                    name_he = name_field or row.get("כתובת") or "מוסד חינוך"
-                name_en = row.get("יישוב") or row.get("כתובת למכתבים") or "Mosdot"
-                frame_type = row.get("סוג מסגרת") or row.get("שלב חינוך") or "mosdot"
-                address_line = row.get("כתובת") or ""
-                city = row.get("יישוב") or ""
-                address = ", ".join([part for part in [address_line, city] if part])
-
-                # Derive a compact english-ish type key for filtering
-                type_key = "mosdot"
-                if isinstance(frame_type, str):
-                    if "גן" in frame_type:
-                        type_key = "kindergartens"
-                    elif any(x in frame_type for x in ["בית ספר", "יסודי", "חטיבת", "תיכון"]):
-                        type_key = "schools"
-
-                pois.append({
-                    "id": idx,
-                    "name_he": name_he,
-                    "name_en": str(name_en),
-                    "type": type_key,
-                    "longitude": lon,
-                    "latitude": lat,
-                    "address": address,
-                    "symbol": symbol_code,
-                })
+        df = pd.read_csv(mosdot_file, dtype=str, encoding="utf-8-sig")
+
+        def col(name: str) -> pd.Series:
+            series = df[name] if name in df.columns else pd.Series("", index=df.index)
+            return series.fillna("").astype(str)
+
+        # ids match the historical 1-based CSV row numbers, assigned before
+        # any filtering so they stay stable across bbox/coordinate drops
+        df["id"] = df.index + 1
+
+        lon = pd.to_numeric(df.get("lon"), errors="coerce")
+        lat = pd.to_numeric(df.get("lat"), errors="coerce")
+        # Filter to Israel-ish bounding box to avoid geocode outliers
+        valid = lat.between(29.0, 33.8) & lon.between(33.5, 36.5)
+        df, lon, lat = df[valid], lon[valid], lat[valid]
+
+        name_field = col("שם וסמל מוסד").where(col("שם וסמל מוסד") != "", col("שם מוסד"))
+        # Split code from name if formatted like "1234 Name"
+        parts = name_field.str.strip().str.extract(r"^(\d{2,6})\s+(.+)$")
+        df["symbol"] = parts[0].fillna("")
+        df["name_he"] = parts[1].fillna(name_field).where(
+            lambda s: s != "", col("כתובת")
+        ).replace("", "מוסד חינוך")
+        name_en = col("יישוב").where(col("יישוב") != "", col("כתובת למכתבים"))
+        df["name_en"] = name_en.replace("", "Mosdot")
+
+        frame_type = col("סוג מסגרת").where(col("סוג מסגרת") != "", col("שלב חינוך"))
+        # Derive a compact english-ish type key for filtering
+        df["type"] = np.select(
+            [
+                frame_type.str.contains("גן", na=False),
+                frame_type.str.contains("בית ספר|יסודי|חטיבת|תיכון", na=False),
+            ],
+            ["kindergartens", "schools"],
+            default="mosdot",
+        )
+
+        address_parts = pd.concat([col("כתובת"), col("יישוב")], axis=1)
+        df["address"] = address_parts.apply(
+            lambda r: ", ".join(part for part in r if part), axis=1
+        )
+        df["longitude"] = lon
+        df["latitude"] = lat
+
+        out = df[
+            ["id", "name_he", "name_en", "type", "longitude", "latitude", "address", "symbol"]
+        ]
+        try:
+            # Best-effort side effect: the next startup skips the CSV parse
+            out.to_parquet(parquet_file, index=False)
+        except Exception as e:
+            print(f"Could not write mosdot.parquet cache: {e}")
+        pois = out.to_dict("records")
     except Exception as e:
         print(f"Error loading mosdot.csv: {e}")
 
@@ -118,62 +141,172 @@ def load_mosdot_data():
 # Load data on startup (mosdot only)
 pois_data = load_mosdot_data()
 
+# Contiguous coordinate arrays, built once at startup; they feed the
+# BallTree, the /pois bbox filter and the /debug/stats aggregates.
+poi_lats = np.array([p["latitude"] for p in pois_data], dtype=np.float64)
+poi_lons = np.array([p["longitude"] for p in pois_data], dtype=np.float64)
+
+# Spatial index over all POIs (haversine metric works on radians), same
+# BallTree approach the ETL uses, plus an id -> index map for O(1) lookups.
+EARTH_RADIUS_KM = 6371
+poi_tree = (
+    BallTree(np.radians(np.column_stack([poi_lats, poi_lons])), metric="haversine")
+    if len(pois_data)
+    else None
+)
+poi_id_to_index = {p["id"]: i for i, p in enumerate(pois_data)}
+
+# Inverted index by type so /pois?poi_type=... and /types never rescan the
+# whole dataset per request.
+poi_type_to_indices: dict[str, list[int]] = {}
+for _i, _p in enumerate(pois_data):
+    if _p.get("type"):
+        poi_type_to_indices.setdefault(_p["type"], []).append(_i)
+poi_type_counts = {t: len(idxs) for t, idxs in poi_type_to_indices.items()}
+
+# The dataset only changes when mosdot.csv is regenerated and the process
+# restarts, so one ETag per process lets clients revalidate with a 304
+# instead of re-downloading the full listing.
+def _dataset_etag() -> str:
+    mosdot_file = PROCESSED_PATH / "mosdot.csv"
+    if mosdot_file.exists():
+        stat = mosdot_file.stat()
+        return f'"{len(pois_data)}-{int(stat.st_mtime)}-{stat.st_size}"'
+    return f'"{len(pois_data)}-empty"'
+
+# Aggregates for /debug/stats never change after load, so compute them once
+# from the coordinate arrays instead of rescanning the dicts per request.
+if pois_data:
+    poi_stats = {
+        "total": len(pois_data),
+        "lat_min": float(poi_lats.min()),
+        "lat_max": float(poi_lats.max()),
+        "lat_mean": round(float(poi_lats.mean()), 6),
+        "lon_min": float(poi_lons.min()),
+        "lon_max": float(poi_lons.max()),
+        "lon_mean": round(float(poi_lons.mean()), 6),
+        "types": list(poi_type_to_indices)[:10],
+        "sample": pois_data[:3],
+    }
+else:
+    poi_stats = {"total": 0}
+
+POIS_ETAG = _dataset_etag()
+POIS_CACHE_CONTROL = "public, max-age=3600, stale-while-revalidate=86400"
+
 @app.get("/")
 def read_root():
     return {"message": "Neighborhood Insights API", "total_pois": len(pois_data)}
 
+# Hard cap so a single request can never ship the entire national dataset
+MAX_POIS_PER_PAGE = 5000
+
+def _first_page_payload(indices: list[int]) -> bytes:
+    page = indices[:MAX_POIS_PER_PAGE]
+    return orjson.dumps({
+        "pois": [pois_data[i] for i in page],
+        "total": len(indices),
+        "offset": 0,
+        "limit": MAX_POIS_PER_PAGE,
+    })
+
+# Serialized first-page responses (overall and per type) built once at
+# startup: the common "give me the POIs" call becomes a cached-bytes reply
+# with no list building or JSON encoding per request.
+POIS_FIRST_PAGE_JSON = _first_page_payload(list(range(len(pois_data))))
+POIS_FIRST_PAGE_JSON_BY_TYPE = {
+    t: _first_page_payload(idxs) for t, idxs in poi_type_to_indices.items()
+}
+
+BBOX_RE = re.compile(
+    r"^(-?\d+(?:\.\d*)?),(-?\d+(?:\.\d*)?),(-?\d+(?:\.\d*)?),(-?\d+(?:\.\d*)?)$"
+)
+
+def parse_bbox(bbox: Optional[str] = Query(None)) -> Optional[tuple[float, float, float, float]]:
+    """Validate a 'min_lon,min_lat,max_lon,max_lat' param with one regex match."""
+    if bbox is None:
+        return None
+    match = BBOX_RE.match(bbox)
+    if not match:
+        raise HTTPException(status_code=400,
+                            detail="bbox must be 'min_lon,min_lat,max_lon,max_lat'")
+    return tuple(float(v) for v in match.groups())
+
 @app.get("/pois")
-def get_all_pois(poi_type: Optional[str] = None, limit: Optional[int] = None):
-    """Get all POIs, optionally filtered by type"""
-    filtered_pois = pois_data
-    
+def get_all_pois(request: Request, response: Response,
+                 poi_type: Optional[str] = None,
+                 limit: Optional[int] = Query(None, ge=1),
+                 offset: int = Query(0, ge=0),
+                 bbox: Optional[tuple[float, float, float, float]] = Depends(parse_bbox)):
+    """Get POIs, optionally filtered by type and/or bbox, paginated.
+
+    bbox is "min_lon,min_lat,max_lon,max_lat" so clients can request only
+    the current viewport instead of the whole dataset.
+    """
+    # RFC 9110: a 304 carries the validator and freshness headers too, so
+    # revalidating clients get a fresh max-age window
+    cache_headers = {"ETag": POIS_ETAG, "Cache-Control": POIS_CACHE_CONTROL}
+    if request.headers.get("if-none-match") == POIS_ETAG:
+        return Response(status_code=304, headers=cache_headers)
+    response.headers.update(cache_headers)
+
+    # Serve the precomputed byte buffer for plain first-page requests
+    if not bbox and not offset and not limit:
+        cached = (POIS_FIRST_PAGE_JSON_BY_TYPE.get(poi_type)
+                  if poi_type else POIS_FIRST_PAGE_JSON)
+        if cached is not None:
+            return Response(content=cached, media_type="application/json",
+                            headers=dict(response.headers))
+
     if poi_type:
-        filtered_pois = [poi for poi in pois_data if poi.get('type') == poi_type]
-    
-    if limit:
-        filtered_pois = filtered_pois[:limit]
-    
+        indices = np.array(poi_type_to_indices.get(poi_type, []), dtype=np.int64)
+    else:
+        indices = np.arange(len(pois_data), dtype=np.int64)
+
+    if bbox:
+        min_lon, min_lat, max_lon, max_lat = bbox
+        in_box = (
+            (poi_lons[indices] >= min_lon) & (poi_lons[indices] <= max_lon)
+            & (poi_lats[indices] >= min_lat) & (poi_lats[indices] <= max_lat)
+        )
+        indices = indices[in_box]
+
+    total = int(indices.size)
+    limit = min(limit, MAX_POIS_PER_PAGE) if limit else MAX_POIS_PER_PAGE
+    page = indices[offset:offset + limit]
+
     return {
-        "pois": filtered_pois,
-        "total": len(filtered_pois),
-        "available_types": list(set(poi.get('type') for poi in pois_data if poi.get('type')))
+        "pois": [pois_data[i] for i in page],
+        "total": total,
+        "offset": offset,
+        "limit": limit,
     }
 
-@app.get("/pois/{poi_id}")
-def get_poi_by_id(poi_id: int):
-    """Get a specific POI by ID"""
-    poi = next((p for p in pois_data if p.get('id') == poi_id), None)
-    if not poi:
-        return {"error": "POI not found"}
-    return poi
-
+# Registered before /pois/{poi_id} so "near" isn't swallowed by the int path
 @app.get("/pois/near")
 def get_pois_near(lat: float, lon: float, radius_km: float = 5.0, poi_type: Optional[str] = None):
-    """Get POIs within a certain radius of a point (simple distance calculation)"""
-    import math
-    
-    def calculate_distance(lat1, lon1, lat2, lon2):
-        # Simple Haversine formula
-        R = 6371  # Earth's radius in km
-        dlat = math.radians(lat2 - lat1)
-        dlon = math.radians(lon2 - lon1)
-        a = math.sin(dlat/2) * math.sin(dlat/2) + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon/2) * math.sin(dlon/2)
-        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-        return R * c
-    
+    """Get POIs within a certain radius of a point (BallTree radius query)"""
     nearby_pois = []
-    
-    for poi in pois_data:
-        if poi.get('latitude') and poi.get('longitude'):
-            distance = calculate_distance(lat, lon, poi['latitude'], poi['longitude'])
-            if distance <= radius_km:
-                poi_with_distance = poi.copy()
-                poi_with_distance['distance_km'] = round(distance, 2)
-                if not poi_type or poi.get('type') == poi_type:
-                    nearby_pois.append(poi_with_distance)
-    
-    # Sort by distance
-    nearby_pois.sort(key=lambda x: x['distance_km'])
+    if poi_tree is None:
+        return {
+            "pois": nearby_pois,
+            "total": 0,
+            "search_center": {"latitude": lat, "longitude": lon},
+            "radius_km": radius_km,
+        }
+
+    # O(log N + k) index probe instead of scanning every POI; the haversine
+    # metric returns exact great-circle distances in radians.
+    center = np.radians([[lat, lon]])
+    indices, distances = poi_tree.query_radius(
+        center, r=radius_km / EARTH_RADIUS_KM, return_distance=True, sort_results=True
+    )
+
+    for i, distance in zip(indices[0], distances[0] * EARTH_RADIUS_KM):
+        poi = pois_data[i]
+        if poi_type and poi.get('type') != poi_type:
+            continue
+        nearby_pois.append({**poi, 'distance_km': round(float(distance), 2)})
     
     return {
         "pois": nearby_pois,
@@ -182,38 +315,27 @@ def get_pois_near(lat: float, lon: float, radius_km: float = 5.0, poi_type: Opti
         "radius_km": radius_km
     }
 
+@app.get("/pois/{poi_id}")
+def get_poi_by_id(poi_id: int):
+    """Get a specific POI by ID"""
+    index = poi_id_to_index.get(poi_id)
+    if index is None:
+        return {"error": "POI not found"}
+    return pois_data[index]
+
 @app.get("/types")
 def get_poi_types():
     """Get all available POI types"""
-    types = list(set(poi.get('type') for poi in pois_data if poi.get('type')))
-    type_counts = {poi_type: len([p for p in pois_data if p.get('type') == poi_type]) for poi_type in types}
-    
     return {
-        "types": types,
-        "counts": type_counts,
-        "total_types": len(types)
+        "types": list(poi_type_to_indices),
+        "counts": poi_type_counts,
+        "total_types": len(poi_type_to_indices)
     }
 
 @app.get("/debug/stats")
 def debug_stats():
     """Return basic stats about loaded POIs to validate coordinates."""
-    if not pois_data:
-        return {"total": 0}
-
-    lats = [p["latitude"] for p in pois_data if isinstance(p.get("latitude"), (int, float))]
-    lons = [p["longitude"] for p in pois_data if isinstance(p.get("longitude"), (int, float))]
-    types = list(set(p.get("type") for p in pois_data))
-    return {
-        "total": len(pois_data),
-        "lat_min": min(lats),
-        "lat_max": max(lats),
-        "lat_mean": round(mean(lats), 6),
-        "lon_min": min(lons),
-        "lon_max": max(lons),
-        "lon_mean": round(mean(lons), 6),
-        "types": types[:10],
-        "sample": pois_data[:3],
-    }
+    return poi_stats
 
 if __name__ == "__main__":
     import uvicorn
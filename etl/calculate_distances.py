@@ -8,8 +8,7 @@ import pandas as pd
 import numpy as np
 from pathlib import Path
 from sklearn.neighbors import BallTree
-from geopy.distance import geodesic
-import json
+import orjson
 
 # Configuration
 DATA_DIR = Path(__file__).parent.parent / "data"
@@ -22,8 +21,14 @@ PROCESSED_DIR.mkdir(parents=True, exist_ok=True)
 PUBLIC_DIR.mkdir(parents=True, exist_ok=True)
 
 def haversine_distance(lat1, lon1, lat2, lon2):
-    """Calculate haversine distance between two points in kilometers."""
-    return geodesic((lat1, lon1), (lat2, lon2)).kilometers
+    """Calculate haversine distance between two points in kilometers.
+
+    Accepts scalars or NumPy arrays; array inputs are computed element-wise
+    in one vectorized pass.
+    """
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371 * np.arcsin(np.sqrt(a))
 
 def load_pois():
     """Load all POI datasets."""
@@ -77,36 +82,29 @@ def create_neighborhoods():
 def find_nearest_pois(neighborhoods_df, pois):
     """Calculate distance to nearest POI of each type for each neighborhood."""
     results = neighborhoods_df.copy()
-    
+
+    # All neighborhood coordinates as one radians array; queried in a single
+    # batched tree traversal per POI type instead of one query per row
+    hood_coords = np.radians(neighborhoods_df[['latitude', 'longitude']].to_numpy())
+
     for poi_type, poi_df in pois.items():
         if len(poi_df) == 0:
             continue
-            
+
         print(f"Calculating distances to {poi_type}...")
-        
+
         # Create BallTree for efficient nearest neighbor search
         # Convert lat/lon to radians for haversine distance
         poi_coords = np.radians(poi_df[['latitude', 'longitude']].values)
         tree = BallTree(poi_coords, metric='haversine')
-        
-        distances = []
-        nearest_poi_names = []
-        
-        for _, neighborhood in neighborhoods_df.iterrows():
-            # Query the tree for nearest POI
-            hood_coord = np.radians([[neighborhood['latitude'], neighborhood['longitude']]])
-            dist, ind = tree.query(hood_coord, k=1)
-            
-            # Convert distance from radians to kilometers
-            distance_km = dist[0][0] * 6371  # Earth radius in km
-            distances.append(round(distance_km, 2))
-            
-            # Get the name of the nearest POI
-            nearest_poi_names.append(poi_df.iloc[ind[0][0]]['name_he'])
-        
-        results[f'{poi_type}_distance_km'] = distances
-        results[f'nearest_{poi_type}'] = nearest_poi_names
-        
+
+        # One batched query for every neighborhood at once
+        dist, ind = tree.query(hood_coords, k=1)
+
+        # Convert distances from radians to kilometers
+        results[f'{poi_type}_distance_km'] = np.round(dist[:, 0] * 6371, 2)
+        results[f'nearest_{poi_type}'] = poi_df['name_he'].to_numpy()[ind[:, 0]]
+
     return results
 
 def calculate_scores(df):
@@ -119,36 +117,36 @@ def calculate_scores(df):
         'bus_stops_distance_km': 0.5
     }
     
-    scores = []
-    for _, row in df.iterrows():
-        score_components = []
-        
-        for distance_col, max_dist in max_distances.items():
-            if distance_col in df.columns:
-                distance = row[distance_col]
-                # Score: 100 for distance 0, linearly decreases to 0 at max_distance
-                score = max(0, 100 * (1 - distance / max_dist))
-                score_components.append(score)
-        
-        # Average score across all available services
-        composite_score = np.mean(score_components) if score_components else 0
-        scores.append(round(composite_score, 1))
-    
-    df['composite_score'] = scores
+    available = {col: max_dist for col, max_dist in max_distances.items() if col in df.columns}
+    if not available:
+        df['composite_score'] = 0.0
+        return df
+
+    # Score: 100 for distance 0, linearly decreasing to 0 at max_distance,
+    # computed for all neighborhoods and services in one array expression
+    distances = df[list(available)].to_numpy(dtype=np.float64)
+    max_dists = np.array(list(available.values()))
+    scores = np.clip(100 * (1 - distances / max_dists), 0, None)
+
+    # Average score across all available services
+    df['composite_score'] = np.round(scores.mean(axis=1), 1)
     return df
 
 def export_for_frontend(df, pois):
     """Export data in formats suitable for the React frontend."""
+    # orjson writes UTF-8 bytes directly (no ensure_ascii escaping pass)
+    def write_json(path, obj):
+        path.write_bytes(orjson.dumps(obj, option=orjson.OPT_INDENT_2))
+
     # 1. Neighborhoods with scores as JSON
     neighborhoods_json = df.to_dict('records')
-    with open(PUBLIC_DIR / 'neighborhoods.json', 'w', encoding='utf-8') as f:
-        json.dump(neighborhoods_json, f, ensure_ascii=False, indent=2)
-    
+    write_json(PUBLIC_DIR / 'neighborhoods.json', neighborhoods_json)
+
     # 2. POIs as GeoJSON for map display
     all_pois = []
     for poi_type, poi_df in pois.items():
-        for _, poi in poi_df.iterrows():
-            all_pois.append({
+        all_pois.extend(
+            {
                 "type": "Feature",
                 "properties": {
                     "id": poi['id'],
@@ -159,22 +157,23 @@ def export_for_frontend(df, pois):
                     "type": "Point",
                     "coordinates": [poi['longitude'], poi['latitude']]
                 }
-            })
-    
+            }
+            for poi in poi_df.to_dict('records')
+        )
+
     pois_geojson = {
         "type": "FeatureCollection",
         "features": all_pois
     }
-    
-    with open(PUBLIC_DIR / 'pois.geojson', 'w', encoding='utf-8') as f:
-        json.dump(pois_geojson, f, ensure_ascii=False, indent=2)
-    
+
+    write_json(PUBLIC_DIR / 'pois.geojson', pois_geojson)
+
     # 3. Neighborhoods as GeoJSON (simple points for now)
     neighborhoods_geojson = {
         "type": "FeatureCollection",
         "features": [
             {
-                "type": "Feature", 
+                "type": "Feature",
                 "properties": {
                     "id": row['id'],
                     "name_he": row['name_he'],
@@ -187,13 +186,12 @@ def export_for_frontend(df, pois):
                     "coordinates": [row['longitude'], row['latitude']]
                 }
             }
-            for _, row in df.iterrows()
+            for row in neighborhoods_json
         ]
     }
-    
-    with open(PUBLIC_DIR / 'neighborhoods.geojson', 'w', encoding='utf-8') as f:
-        json.dump(neighborhoods_geojson, f, ensure_ascii=False, indent=2)
-    
+
+    write_json(PUBLIC_DIR / 'neighborhoods.geojson', neighborhoods_geojson)
+
     print(f"Exported data to {PUBLIC_DIR}/")
     print(f"  - {len(neighborhoods_json)} neighborhoods")
     print(f"  - {len(all_pois)} POIs")
@@ -5,15 +5,16 @@
 Geocode an XLSX with Hebrew columns: 'כתובת' (street) and 'יישוב' (city) using public Nominatim.
 - Input:  .xlsx with any columns (must include 'כתובת' and 'יישוב')
 - Output: .csv with ALL original columns + 'lon','lat','geocode_error'
-- CACHE:  The output CSV *is* the cache. Re-runs only geocode rows missing lon/lat.
+- CACHE:  A sidecar sqlite DB ('<out>.cache') keyed by address; every result
+          is checkpointed as a single row. Re-runs only geocode rows missing
+          lon/lat after the cache is applied; the CSV is written once at end.
 
 Usage:
   python geocode_xlsx_to_csv_cache.py \
     --in addresses.xlsx \
     --out geocoded.csv \
     --sleep 1.1 \
-    --country "Israel" \
-    --checkpoint-every 250
+    --country "Israel"
 
 Notes:
 - Respects public Nominatim usage (>=1 req/sec). Do not bulk 35k on the public server.
@@ -23,13 +24,16 @@ Notes:
 from __future__ import annotations
 import argparse
 import os
+import sqlite3
 import time
 import re
 from typing import Dict, Optional, Tuple
 
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm
+from urllib3.util.retry import Retry
 
 
 # ----------------------------
@@ -45,14 +49,46 @@ def make_address_key(address: Optional[str], city: Optional[str], country: Optio
     return " | ".join(parts) if parts else None
 
 
+def make_address_keys(df: pd.DataFrame, country: Optional[str]) -> pd.Series:
+    """Vectorized make_address_key over the 'כתובת'/'יישוב' columns.
+
+    Same normalization (whitespace collapse, strip, lower) and the same
+    " | " join that skips empty parts, but done with pandas string kernels
+    instead of a per-row apply.
+    """
+    def vec_norm(s: pd.Series) -> pd.Series:
+        return s.astype(str).str.replace(r"\s+", " ", regex=True).str.strip().str.lower()
+
+    addr = vec_norm(df["כתובת"])
+    city = vec_norm(df["יישוב"])
+    country_part = normalize_space(country or "").lower()
+
+    keys = (addr + " | ").where(addr != "", "") + (city + " | ").where(city != "", "")
+    if country_part:
+        keys = keys + country_part
+    else:
+        keys = keys.str.replace(r" \| $", "", regex=True)
+    return keys.where(keys != "", None)
+
+
 # ----------------------------
 # Nominatim client
 # ----------------------------
 
 class NominatimClient:
-    def __init__(self, min_interval_s: float = 1.1,
+    def __init__(self, min_interval_s: float = 1.1, retries: int = 2,
                  user_agent: str = "neighborhood-insights-il/etl (+https://example.org)"):
         self.session = requests.Session()
+        # Retries live in urllib3: backoff, 429/5xx status handling and
+        # Retry-After support, all on the kept-alive connection
+        retry = Retry(
+            total=retries,
+            backoff_factor=0.6,
+            status_forcelist=(429, 502, 503, 504),
+            allowed_methods=frozenset(["GET"]),
+        )
+        self.session.mount("https://", HTTPAdapter(max_retries=retry))
+        self.session.mount("http://", HTTPAdapter(max_retries=retry))
         self.min_interval_s = max(1.0, float(min_interval_s))
         self.user_agent = user_agent
         self._last_ts = 0.0
@@ -63,8 +99,8 @@ class NominatimClient:
         if delta < self.min_interval_s:
             time.sleep(self.min_interval_s - delta)
 
-    def geocode(self, *, street: Optional[str], city: Optional[str], country: Optional[str],
-                retries: int = 2) -> Tuple[Optional[float], Optional[float], Optional[str]]:
+    def geocode(self, *, street: Optional[str], city: Optional[str],
+                country: Optional[str]) -> Tuple[Optional[float], Optional[float], Optional[str]]:
         """
         Returns (lon, lat, error). If success, error=None.
         """
@@ -92,32 +128,55 @@ class NominatimClient:
             "Accept": "application/json",
         }
 
-        last_err = None
-        for attempt in range(retries + 1):
-            try:
-                self._pace()
-                resp = self.session.get(url, params=params, headers=headers, timeout=20)
-                self._last_ts = time.monotonic()
-                if resp.status_code in (429, 502, 503, 504) or 500 <= resp.status_code < 600:
-                    last_err = f"http_{resp.status_code}"
-                    time.sleep(min(3.0, 0.5 * (2 ** attempt)))
-                    continue
-                data = resp.json()
-                if data:
-                    lat = float(data[0]["lat"])
-                    lon = float(data[0]["lon"])
-                    return lon, lat, None
-                return None, None, "no_result"
-            except Exception as e:
-                last_err = f"exc:{type(e).__name__}"
-                time.sleep(min(3.0, 0.5 * (2 ** attempt)))
-        return None, None, last_err or "error"
+        try:
+            self._pace()
+            resp = self.session.get(url, params=params, headers=headers, timeout=20)
+            self._last_ts = time.monotonic()
+            if resp.status_code >= 400:
+                # Retryable statuses were already retried by the adapter
+                return None, None, f"http_{resp.status_code}"
+            data = resp.json()
+            if data:
+                lat = float(data[0]["lat"])
+                lon = float(data[0]["lon"])
+                return lon, lat, None
+            return None, None, "no_result"
+        except Exception as e:
+            return None, None, f"exc:{type(e).__name__}"
 
 
 # ----------------------------
 # Core
 # ----------------------------
 
+def apply_fresh_results(df_out: pd.DataFrame, fresh: Dict[str, Tuple[Optional[float], Optional[float], Optional[str]]]):
+    """Write freshly geocoded (lon, lat, err) tuples into df_out in one pass.
+
+    One reindex against a lookup frame replaces three per-row .map(lambda)
+    walks over the same subset.
+    """
+    if not fresh:
+        return
+    fdf = pd.DataFrame.from_dict(fresh, orient="index", columns=["lon", "lat", "geocode_error"])
+    sub = df_out["__address_key"].isin(fdf.index)
+    df_out.loc[sub, ["lon", "lat", "geocode_error"]] = (
+        fdf.reindex(df_out.loc[sub, "__address_key"]).to_numpy()
+    )
+
+
+def open_geocode_cache(path: str) -> sqlite3.Connection:
+    """Open (and create if needed) the sidecar sqlite geocode cache."""
+    con = sqlite3.connect(path)
+    con.execute(
+        "CREATE TABLE IF NOT EXISTS geocode (k TEXT PRIMARY KEY, lon REAL, lat REAL, err TEXT)"
+    )
+    return con
+
+
+def load_geocode_cache(con: sqlite3.Connection) -> Dict[str, Tuple[Optional[float], Optional[float], Optional[str]]]:
+    return {k: (lon, lat, err) for k, lon, lat, err in con.execute("SELECT k, lon, lat, err FROM geocode")}
+
+
 def atomic_write_csv(df: pd.DataFrame, path: str):
     tmp = f"{path}.tmp"
     # UTF-8 with BOM helps Excel users see Hebrew correctly
@@ -136,7 +195,6 @@ def main():
                     help="Output CSV path (also used as cache on re-runs)")
     ap.add_argument("--sleep", type=float, default=1.1, help="Seconds between requests (>=1.0 for public Nominatim)")
     ap.add_argument("--country", default="Israel", help="Country appended to the address key")
-    ap.add_argument("--checkpoint-every", type=int, default=25, help="Write CSV every N newly geocoded addresses")
     ap.add_argument("--max-rows", type=int, default=None, help="Optional limit on number of input rows to process")
     args = ap.parse_args()
 
@@ -186,13 +244,22 @@ def main():
             if c not in df_out.columns:
                 df_out[c] = None
 
-    # Build address_key for all rows
-    addr_keys = (
-        df_out[required_cols]
-        .astype(str)
-        .apply(lambda r: make_address_key(r["כתובת"], r["יישוב"], args.country), axis=1)
-    )
-    df_out["__address_key"] = addr_keys
+    # A re-loaded cache CSV arrives as all-string columns; the isna() checks
+    # and the bulk float assignment in apply_fresh_results both need numeric
+    # lon/lat (and an object-dtype error column)
+    df_out["lon"] = pd.to_numeric(df_out["lon"], errors="coerce")
+    df_out["lat"] = pd.to_numeric(df_out["lat"], errors="coerce")
+    df_out["geocode_error"] = df_out["geocode_error"].astype(object)
+
+    # Build address_key for all rows (vectorized)
+    df_out["__address_key"] = make_address_keys(df_out, args.country)
+
+    # Sidecar sqlite cache: one row per geocoded address_key. Each result is
+    # a single cheap INSERT instead of rewriting the whole CSV every N rows.
+    con = open_geocode_cache(f"{args.out}.cache")
+    cached = load_geocode_cache(con)
+    if cached:
+        apply_fresh_results(df_out, cached)
 
     # Prepare list of unique address keys to geocode (missing lon/lat only)
     df_missing = df_out[(df_out["lon"].isna()) | (df_out["lat"].isna())].copy()
@@ -212,38 +279,24 @@ def main():
         for _, row in df_out.loc[df_out["__address_key"].isin(pending_keys), required_cols + ["__address_key"]].drop_duplicates("__address_key").iterrows():
             key_to_parts[row["__address_key"]] = (row["כתובת"], row["יישוב"])
 
-        pbar = tqdm(pending_keys, desc="Geocoding (CSV cache)", unit="addr")
-        since_last_checkpoint = 0
+        pbar = tqdm(pending_keys, desc="Geocoding (sqlite cache)", unit="addr")
         for k in pbar:
             if k in fresh:
                 continue
             street, city = key_to_parts.get(k, (None, None))
             lon, lat, err = client.geocode(street=street, city=city, country=args.country)
             fresh[k] = (lon, lat, err)
-            since_last_checkpoint += 1
-
-            # Periodic checkpoint: write results into df_out and flush CSV
-            if since_last_checkpoint >= max(25, args.checkpoint_every):
-                # Apply fresh to df_out
-                sub = df_out["__address_key"].isin(list(fresh.keys()))
-                df_out.loc[sub, "lon"] = df_out.loc[sub, "__address_key"].map(lambda kk: fresh[kk][0])
-                df_out.loc[sub, "lat"] = df_out.loc[sub, "__address_key"].map(lambda kk: fresh[kk][1])
-                df_out.loc[sub, "geocode_error"] = df_out.loc[sub, "__address_key"].map(lambda kk: fresh[kk][2])
-                atomic_write_csv(df_out, args.out)
-                fresh.clear()
-                since_last_checkpoint = 0
-
-        # Final flush
-        if fresh:
-            sub = df_out["__address_key"].isin(list(fresh.keys()))
-            df_out.loc[sub, "lon"] = df_out.loc[sub, "__address_key"].map(lambda kk: fresh[kk][0])
-            df_out.loc[sub, "lat"] = df_out.loc[sub, "__address_key"].map(lambda kk: fresh[kk][1])
-            df_out.loc[sub, "geocode_error"] = df_out.loc[sub, "__address_key"].map(lambda kk: fresh[kk][2])
-            atomic_write_csv(df_out, args.out)
-            fresh.clear()
-    else:
-        # Nothing to geocode; still ensure file exists
-        atomic_write_csv(df_out, args.out)
+
+            # Checkpoint is one sqlite row, safe to interrupt at any point
+            con.execute("INSERT OR REPLACE INTO geocode VALUES (?,?,?,?)", (k, lon, lat, err))
+            con.commit()
+
+        apply_fresh_results(df_out, fresh)
+        fresh.clear()
+
+    # Write the CSV once, at the end
+    atomic_write_csv(df_out, args.out)
+    con.close()
 
     # Clean up: optional — drop helper key
     # (Leave it if you want re-runs to be even faster and diffable.)